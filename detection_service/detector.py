@@ -10,12 +10,15 @@ detector.py - Detection Service
 
 import cv2
 import pika
-import json
+import msgpack
+import orjson
 import os
-import base64
 import logging
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
+from psycopg2.extras import execute_values
 from datetime import datetime
 from ultralytics import YOLO
 import numpy as np
@@ -41,66 +44,190 @@ VIOLATION_DELAY_FRAMES = 10
 # Memory optimization - نقلل الـ JPEG quality عشان نوفر RAM
 JPEG_QUALITY = 70
 
-
-def box_iou(box1, box2):
-    x1, y1, x2, y2 = box1
-    x1_, y1_, x2_, y2_ = box2
-    xi1 = max(x1, x1_)
-    yi1 = max(y1, y1_)
-    xi2 = min(x2, x2_)
-    yi2 = min(y2, y2_)
-    inter_area = max(0, xi2 - xi1) * max(0, yi2 - yi1)
-    box1_area = (x2 - x1) * (y2 - y1)
-    box2_area = (x2_ - x1_) * (y2_ - y1_)
-    union_area = box1_area + box2_area - inter_area
-    return inter_area / union_area if union_area > 0 else 0
-
-
-def box_center(box):
-    x1, y1, x2, y2 = box
-    return ((x1 + x2) // 2, (y1 + y2) // 2)
-
-
-def is_in_roi(box, roi):
-    cx, cy = box_center(box)
-    x, y, w, h = roi["x"], roi["y"], roi["w"], roi["h"]
-    return x <= cx <= x + w and y <= cy <= y + h
-
-
-def is_near_pizza(hand_box, pizza_box, margin=0.5):
-    hx, hy = box_center(hand_box)
-    px1, py1, px2, py2 = pizza_box
-    pw, ph = px2 - px1, py2 - py1
-    exp_x1 = px1 - pw * margin
-    exp_y1 = py1 - ph * margin
-    exp_x2 = px2 + pw * margin
-    exp_y2 = py2 + ph * margin
-    return exp_x1 <= hx <= exp_x2 and exp_y1 <= hy <= exp_y2
-
-
-def is_scooper_at_pizza(scooper_boxes, pizza_box, margin=0.4):
-    for s_box in scooper_boxes:
-        sx, sy = box_center(s_box)
-        px1, py1, px2, py2 = pizza_box
-        pw, ph = px2 - px1, py2 - py1
-        exp_x1 = px1 - pw * margin
-        exp_y1 = py1 - ph * margin
-        exp_x2 = px2 + pw * margin
-        exp_y2 = py2 + ph * margin
-        if exp_x1 <= sx <= exp_x2 and exp_y1 <= sy <= exp_y2:
-            return True
-    return False
+# frame_queue bounded - لو الـ detector اتأخر الـ broker يرمي القديم بدل ما يكوم
+# (real-time monitor - frame عمرها ثانيتين ملهاش قيمة)
+FRAME_QUEUE_ARGS = {
+    "x-message-ttl": 2000,
+    "x-max-length": 60,
+    "x-overflow": "drop-head",
+}
+
+# results_queue transient - drop-head عشان الـ preview مش يكوم في الـ broker
+RESULTS_QUEUE_ARGS = {"x-max-length": 100, "x-overflow": "drop-head"}
+
+# Preview stream resolution - الـ full res بيتحفظ للمخالفات بس
+PREVIEW_W = int(os.getenv("PREVIEW_W", 640))
+PREVIEW_H = int(os.getenv("PREVIEW_H", 360))
+
+# JPEG codecs - NVJPEG على الـ GPU لو مفعل، TurboJPEG (SIMD) كـ fallback على CPU
+USE_NVJPEG = os.getenv("USE_NVJPEG", "0") == "1"
+
+try:
+    from torchvision import io as tv_io
+except ImportError:
+    tv_io = None
+
+try:
+    from turbojpeg import TurboJPEG
+
+    _turbo = TurboJPEG()
+except Exception:
+    _turbo = None
+
+
+def _nvjpeg_available():
+    return USE_NVJPEG and tv_io is not None and torch.cuda.is_available()
+
+
+def decode_jpeg(data):
+    """JPEG decode - NVJPEG على الـ GPU لو مفعل، وإلا TurboJPEG، وإلا cv2"""
+    if _nvjpeg_available():
+        buf = torch.from_numpy(np.frombuffer(data, dtype=np.uint8).copy())
+        tensor = tv_io.decode_jpeg(buf, mode=tv_io.ImageReadMode.RGB, device="cuda")
+        # CHW RGB على الـ GPU → HWC BGR numpy لباقي الـ pipeline (tracking/drawing)
+        return tensor.flip(0).permute(1, 2, 0).contiguous().cpu().numpy()
+    if _turbo is not None:
+        return _turbo.decode(data)
+    arr = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(arr, cv2.IMREAD_COLOR)
+
+
+def encode_jpeg(frame, quality=JPEG_QUALITY):
+    """JPEG encode بنفس ترتيب التفضيل بتاع decode_jpeg"""
+    if _nvjpeg_available():
+        tensor = (
+            torch.from_numpy(np.ascontiguousarray(frame[:, :, ::-1]))
+            .permute(2, 0, 1)
+            .cuda()
+        )
+        return bytes(tv_io.encode_jpeg(tensor, quality=quality).cpu().numpy())
+    if _turbo is not None:
+        return _turbo.encode(frame, quality=quality)
+    _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+# TensorRT export settings - نثبت الـ imgsz عشان الـ engine bindings
+IMG_SIZE = 640
+
+# Batching - نجمع frames ونعمل forward pass واحد بدل frame-by-frame
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 16))
+BATCH_FLUSH_SECS = 0.05
+ENGINE_BATCH = int(os.getenv("ENGINE_BATCH", BATCH_SIZE))
+
+# Full GC sweep كل كام frame بس - مش كل frame
+GC_EVERY_FRAMES = 300
+
+# (color, thickness, font_scale) لكل class - عشان الـ draw pass الواحد
+DRAW_STYLES = {
+    "Hand": ((0, 255, 0), 2, 0.5),
+    "Scooper": ((255, 0, 255), 2, 0.5),
+    "Pizza": ((0, 165, 255), 2, 0.5),
+    "Person": ((0, 255, 0), 1, 0.4),
+}
+
+
+# Numba (اختياري) - explicit loops تحت الـ JIT أسرع من الـ broadcasting على CPU
+# لأنها بتتجنب الـ temporary arrays، مفيد للـ CPU-only deployments
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+if njit is not None:
+
+    @njit(cache=True, fastmath=True)
+    def _iou_matrix_jit(a, b):
+        n, m = a.shape[0], b.shape[0]
+        out = np.empty((n, m), dtype=np.float32)
+        for i in range(n):
+            area_a = (a[i, 2] - a[i, 0]) * (a[i, 3] - a[i, 1])
+            for j in range(m):
+                xi1 = max(a[i, 0], b[j, 0])
+                yi1 = max(a[i, 1], b[j, 1])
+                xi2 = min(a[i, 2], b[j, 2])
+                yi2 = min(a[i, 3], b[j, 3])
+                inter = max(0.0, xi2 - xi1) * max(0.0, yi2 - yi1)
+                area_b = (b[j, 2] - b[j, 0]) * (b[j, 3] - b[j, 1])
+                out[i, j] = inter / (area_a + area_b - inter + 1e-9)
+        return out
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU matrix (N,M) بين مجموعتين boxes بـ broadcasting بدل double loop"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    if njit is not None:
+        return _iou_matrix_jit(a, b)
+    xi1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    yi1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    xi2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    yi2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(xi2 - xi1, 0, None) * np.clip(yi2 - yi1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def box_centers(boxes):
+    """مراكز الـ boxes كلها مرة واحدة (N,2)"""
+    a = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return np.stack([(a[:, 0] + a[:, 2]) / 2, (a[:, 1] + a[:, 3]) / 2], axis=1)
+
+
+def expand_boxes(boxes, margin):
+    """يوسع الـ boxes بنسبة margin من الـ width/height بتاعها"""
+    a = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    w = a[:, 2] - a[:, 0]
+    h = a[:, 3] - a[:, 1]
+    return np.stack(
+        [a[:, 0] - w * margin, a[:, 1] - h * margin,
+         a[:, 2] + w * margin, a[:, 3] + h * margin],
+        axis=1,
+    )
+
+
+def points_in_rects(points, rects):
+    """(N,2) points ضد (M,4) rects → (N,M) bool matrix"""
+    p = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    r = np.asarray(rects, dtype=np.float32).reshape(-1, 4)
+    return (
+        (p[:, None, 0] >= r[None, :, 0])
+        & (p[:, None, 0] <= r[None, :, 2])
+        & (p[:, None, 1] >= r[None, :, 1])
+        & (p[:, None, 1] <= r[None, :, 3])
+    )
+
+
+# Hand state codes - int8 بدل strings عشان الـ SoA arrays
+STATE_IN_ROI = 0
+STATE_TRACKING = 1
+STATE_WAITING = 2
+STATE_DONE = 3
 
 
 class HandTracker:
     def __init__(self, rois):
         self.next_id = 0
-        self.hands = {}
         self.violations = []
         self.rois = rois
         self.scooper_history = []
         self.pending_violations = {}
 
+        # Structure-of-Arrays بدل dict-of-dicts - parallel arrays للأيدي المتتبعة
+        # الـ scans بقت linear و cache-friendly والـ removals بقت mask compaction
+        self.hand_ids = np.empty(0, dtype=np.int64)
+        self.hand_boxes = np.empty((0, 4), dtype=np.float32)
+        self.hand_states = np.empty(0, dtype=np.int8)
+        self.hand_frames_since = np.empty(0, dtype=np.int32)
+        self.hand_roi_names = []
+
+        # الـ ROIs ثابتة من الـ startup - نحسب الـ rects مرة واحدة هنا
+        self.roi_rects = np.array(
+            [[r["x"], r["y"], r["x"] + r["w"], r["y"] + r["h"]] for r in rois],
+            dtype=np.float32,
+        )
+        self.roi_names = [r["name"] for r in rois]
+
     def update(self, hand_boxes, scooper_boxes, pizza_boxes, frame_num):
         # Update scooper history
         self.scooper_history.append(scooper_boxes)
@@ -111,99 +238,104 @@ class HandTracker:
         for hist_scoopers in self.scooper_history:
             all_recent_scoopers.extend(hist_scoopers)
 
-        matched_hands = set()
-        new_hands = []
-
-        # Match existing hands
-        for hand_box in hand_boxes:
-            matched = False
-            for hand_id, hand_data in self.hands.items():
-                if hand_id in matched_hands:
+        n_dets = len(hand_boxes)
+        n_tracked = len(self.hand_ids)
+        matched = np.zeros(n_tracked, dtype=bool)
+        new_det_indices = []
+
+        # نحسب كل الـ geometry مرة واحدة بدل per-box loops
+        # الـ ROI rects متحسبة في الـ __init__ أصلاً
+        in_roi = None
+        near_pizza = None
+        if n_dets:
+            det_centers = box_centers(hand_boxes)
+            in_roi = points_in_rects(det_centers, self.roi_rects)  # (N,R)
+            if len(pizza_boxes):
+                pizza_exp = expand_boxes(pizza_boxes, 0.5)
+                near_pizza = points_in_rects(det_centers, pizza_exp)  # (N,K)
+
+        # Match existing hands - IoU matrix واحدة + greedy argmax assignment
+        if n_dets and n_tracked:
+            iou = iou_matrix(hand_boxes, self.hand_boxes)  # (N,M)
+
+            for i in range(n_dets):
+                row = np.where(matched, -1.0, iou[i])
+                j = int(row.argmax())
+                if row[j] <= IOU_THRESHOLD:
+                    new_det_indices.append(i)
                     continue
-                if box_iou(hand_box, hand_data["box"]) > IOU_THRESHOLD:
-                    old_state = hand_data["state"]
-                    hand_data["box"] = hand_box
-                    hand_data["frames_since_update"] = 0
-
-                    # Check ROI
-                    current_roi = None
-                    for roi in self.rois:
-                        if is_in_roi(hand_box, roi):
-                            current_roi = roi
-                            break
-
-                    # State machine
-                    if current_roi:
-                        if old_state != "in_roi":
-                            logger.info(
-                                f"  Hand {hand_id} ENTERED ROI: {current_roi['name']}"
-                            )
-                        hand_data["state"] = "in_roi"
-                        hand_data["roi_name"] = current_roi["name"]
-
-                    elif old_state == "in_roi":
+                matched[j] = True
+
+                hand_id = int(self.hand_ids[j])
+                old_state = int(self.hand_states[j])
+                self.hand_boxes[j] = hand_boxes[i]
+                self.hand_frames_since[j] = 0
+
+                # Check ROI
+                current_roi_name = None
+                roi_hits = np.nonzero(in_roi[i])[0]
+                if roi_hits.size:
+                    current_roi_name = self.roi_names[roi_hits[0]]
+
+                # State machine
+                if current_roi_name is not None:
+                    if old_state != STATE_IN_ROI:
                         logger.info(
-                            f"  Hand {hand_id} LEFT ROI '{hand_data['roi_name']}' - tracking..."
+                            f"  Hand {hand_id} ENTERED ROI: {current_roi_name}"
                         )
-                        hand_data["state"] = "tracking_to_pizza"
-
-                    elif hand_data["state"] == "tracking_to_pizza":
-                        for pizza_box in pizza_boxes:
-                            if is_near_pizza(hand_box, pizza_box):
-                                logger.info(
-                                    f"  Hand {hand_id} at pizza - checking for scooper..."
-                                )
-                                self.pending_violations[hand_id] = {
-                                    "frame": frame_num,
-                                    "pizza_box": pizza_box,
-                                    "roi_name": hand_data["roi_name"],
-                                    "delay_counter": 0,
-                                }
-                                hand_data["state"] = "waiting_at_pizza"
-                                break
-
-                    elif hand_data["state"] == "waiting_at_pizza":
-                        pass
-
-                    matched_hands.add(hand_id)
-                    matched = True
-                    break
-
-            if not matched:
-                new_hands.append(hand_box)
-
-        # Add new hands (only from ROI)
-        for hand_box in new_hands:
-            in_roi = False
-            roi_name = None
-            for roi in self.rois:
-                if is_in_roi(hand_box, roi):
-                    in_roi = True
-                    roi_name = roi["name"]
-                    break
-            if in_roi:
-                self.hands[self.next_id] = {
-                    "box": hand_box,
-                    "state": "in_roi",
-                    "frames_since_update": 0,
-                    "roi_name": roi_name,
-                }
-                logger.info(f"  New Hand {self.next_id} in ROI '{roi_name}'")
-                self.next_id += 1
+                    self.hand_states[j] = STATE_IN_ROI
+                    self.hand_roi_names[j] = current_roi_name
+
+                elif old_state == STATE_IN_ROI:
+                    logger.info(
+                        f"  Hand {hand_id} LEFT ROI '{self.hand_roi_names[j]}' - tracking..."
+                    )
+                    self.hand_states[j] = STATE_TRACKING
+
+                elif old_state == STATE_TRACKING:
+                    if near_pizza is not None:
+                        pizza_hits = np.nonzero(near_pizza[i])[0]
+                        if pizza_hits.size:
+                            logger.info(
+                                f"  Hand {hand_id} at pizza - checking for scooper..."
+                            )
+                            self.pending_violations[hand_id] = {
+                                "frame": frame_num,
+                                "pizza_box": pizza_boxes[pizza_hits[0]],
+                                "roi_name": self.hand_roi_names[j],
+                                "delay_counter": 0,
+                            }
+                            self.hand_states[j] = STATE_WAITING
+
+                elif old_state == STATE_WAITING:
+                    pass
+        else:
+            new_det_indices = list(range(n_dets))
 
         # Check pending violations
         # الفرق الوحيد: نجمع كل المخالفات في list مش بس الأخيرة
         resolved_pending = []
         new_violations = []  # list مش single value
 
+        # مراكز كل الـ scoopers الـ recent مرة واحدة للـ pending checks
+        scooper_centers = (
+            box_centers(all_recent_scoopers) if all_recent_scoopers else None
+        )
+
         for hand_id, pending in self.pending_violations.items():
             pending["delay_counter"] += 1
 
-            if is_scooper_at_pizza(all_recent_scoopers, pending["pizza_box"]):
+            scooper_at_pizza = False
+            if scooper_centers is not None:
+                pizza_rect = expand_boxes([pending["pizza_box"]], 0.4)
+                scooper_at_pizza = bool(
+                    points_in_rects(scooper_centers, pizza_rect).any()
+                )
+
+            if scooper_at_pizza:
                 logger.info(f"  Scooper detected at pizza for Hand {hand_id} - OK!")
                 resolved_pending.append(hand_id)
-                if hand_id in self.hands:
-                    self.hands[hand_id]["state"] = "done"
+                self._set_state(hand_id, STATE_DONE)
 
             elif pending["delay_counter"] >= VIOLATION_DELAY_FRAMES:
                 violation = {
@@ -217,34 +349,65 @@ class HandTracker:
                     f"VIOLATION #{len(self.violations)} - No scooper from '{pending['roi_name']}'!"
                 )
                 resolved_pending.append(hand_id)
-                if hand_id in self.hands:
-                    self.hands[hand_id]["state"] = "done"
+                self._set_state(hand_id, STATE_DONE)
 
         for hand_id in resolved_pending:
             del self.pending_violations[hand_id]
 
-        # Remove lost hands
-        lost_hands = []
-        for hand_id in list(self.hands.keys()):
-            if hand_id not in matched_hands:
-                self.hands[hand_id]["frames_since_update"] += 1
-                timeout = HAND_TIMEOUT_FRAMES
-                if self.hands[hand_id]["state"] in [
-                    "tracking_to_pizza",
-                    "waiting_at_pizza",
-                ]:
-                    timeout = HAND_TIMEOUT_FRAMES * 2
-                if self.hands[hand_id]["frames_since_update"] > timeout:
-                    lost_hands.append(hand_id)
-                    if hand_id in self.pending_violations:
-                        del self.pending_violations[hand_id]
-
-        for hand_id in lost_hands:
-            del self.hands[hand_id]
+        # Remove lost hands - mask compaction بدل dict deletes
+        if n_tracked:
+            unmatched = ~matched
+            self.hand_frames_since[unmatched] += 1
+            timeouts = np.where(
+                (self.hand_states == STATE_TRACKING)
+                | (self.hand_states == STATE_WAITING),
+                HAND_TIMEOUT_FRAMES * 2,
+                HAND_TIMEOUT_FRAMES,
+            )
+            keep = self.hand_frames_since <= timeouts
+            if not keep.all():
+                for hand_id in self.hand_ids[~keep]:
+                    self.pending_violations.pop(int(hand_id), None)
+                self._compact(keep)
+
+        # Add new hands (only from ROI) - بعد الـ compaction عشان الـ masks تفضل متظبطة
+        for i in new_det_indices:
+            roi_hits = np.nonzero(in_roi[i])[0]
+            if roi_hits.size:
+                roi_name = self.roi_names[roi_hits[0]]
+                self._append_hand(hand_boxes[i], roi_name)
+                logger.info(f"  New Hand {self.next_id - 1} in ROI '{roi_name}'")
 
         # رجع list المخالفات الجديدة (ممكن يكون فيها أكتر من واحدة في نفس الـ frame)
         return new_violations
 
+    def _append_hand(self, box, roi_name):
+        """يضيف يد جديدة لكل الـ parallel arrays"""
+        self.hand_ids = np.append(self.hand_ids, np.int64(self.next_id))
+        self.hand_boxes = np.vstack(
+            [self.hand_boxes, np.asarray(box, dtype=np.float32).reshape(1, 4)]
+        )
+        self.hand_states = np.append(self.hand_states, np.int8(STATE_IN_ROI))
+        self.hand_frames_since = np.append(self.hand_frames_since, np.int32(0))
+        self.hand_roi_names.append(roi_name)
+        self.next_id += 1
+
+    def _compact(self, keep):
+        """يشيل الأيدي اللي keep=False بتاعتها من كل الـ arrays"""
+        self.hand_ids = self.hand_ids[keep]
+        self.hand_boxes = self.hand_boxes[keep]
+        self.hand_states = self.hand_states[keep]
+        self.hand_frames_since = self.hand_frames_since[keep]
+        self.hand_roi_names = [
+            name for name, k in zip(self.hand_roi_names, keep) if k
+        ]
+
+    def _set_state(self, hand_id, state):
+        """يحدث state يد معينة بالـ id بتاعها (لو لسه متتبعة)"""
+        idx = np.nonzero(self.hand_ids == hand_id)[0]
+        if idx.size:
+            self.hand_states[idx[0]] = state
+
     def get_violation_count(self):
         return len(self.violations)
 
@@ -265,19 +428,36 @@ class ViolationDetector:
         self.pg_pass = os.getenv("POSTGRES_PASSWORD", "pizza_pass")
         self.pg_db = os.getenv("POSTGRES_DB", "pizza_violations")
 
-        # Model path
+        # Model paths - نفضل الـ TensorRT engine لو موجود
         self.model_path = "/app/models/best.pt"
+        self.engine_path = "/app/models/best.engine"
 
         # Connections
         self.rabbitmq_connection = None
         self.rabbitmq_channel = None
         self.pg_connection = None
         self.model = None
+        self.name2id = {}
 
         # ROIs و Tracker
         self.rois = self.load_rois()
         self.tracker = HandTracker(self.rois)
 
+        # Batch buffer - frames مستنية الـ inference
+        self._pending = []
+        self._frames_since_gc = 0
+
+        # Violation rows مستنية الـ batched insert
+        self._violation_batch = []
+
+        # I/O pool - كتابة صور المخالفات بتحصل في الخلفية مش على الـ hot path
+        self._io_pool = ThreadPoolExecutor(max_workers=2)
+        self._pg_lock = threading.Lock()
+
+        # Consumer check cache لـ results_queue
+        self._has_consumers = True
+        self._consumers_checked_at = 0.0
+
     # ---------------- ROI Loading ----------------
     def load_rois(self):
         """
@@ -292,8 +472,8 @@ class ViolationDetector:
 
         for path in possible_paths:
             if os.path.exists(path):
-                with open(path, "r") as f:
-                    config = json.load(f)
+                with open(path, "rb") as f:
+                    config = orjson.loads(f.read())
                 logger.info(f"Loaded {len(config['rois'])} ROIs from: {path}")
                 return config["rois"]
 
@@ -319,8 +499,8 @@ class ViolationDetector:
                 )
                 self.rabbitmq_connection = pika.BlockingConnection(parameters)
                 self.rabbitmq_channel = self.rabbitmq_connection.channel()
-                self.rabbitmq_channel.queue_declare(queue="frame_queue", durable=True)
-                self.rabbitmq_channel.queue_declare(queue="results_queue", durable=True)
+                self.declare_frame_queue()
+                self.declare_results_queue()
                 logger.info("Connected to RabbitMQ")
                 return True
             except Exception as e:
@@ -332,6 +512,40 @@ class ViolationDetector:
         logger.error("RabbitMQ: all retry attempts failed")
         return False
 
+    def declare_frame_queue(self):
+        """frame_queue بـ TTL و max-length - الـ backpressure بيرمي الـ frames القديمة"""
+        try:
+            self.rabbitmq_channel.queue_declare(
+                queue="frame_queue", durable=False, arguments=FRAME_QUEUE_ARGS
+            )
+        except pika.exceptions.ChannelClosedByBroker:
+            # الـ queue القديمة متعملة بـ properties مختلفة - نمسحها ونعيد الإعلان
+            self.rabbitmq_channel = self.rabbitmq_connection.channel()
+            self.rabbitmq_channel.queue_delete(queue="frame_queue")
+            self.rabbitmq_channel.queue_declare(
+                queue="frame_queue", durable=False, arguments=FRAME_QUEUE_ARGS
+            )
+
+    def declare_results_queue(self):
+        """results_queue transient + drop-head
+        الـ preview frames ملهاش قيمة بعد ما الـ frame اللي بعدها توصل
+        فمفيش داعي للـ fsync بتاع الـ durable queues، والـ max-length بيحمي الـ broker"""
+        try:
+            self.rabbitmq_channel.queue_declare(
+                queue="results_queue",
+                durable=False,
+                arguments=RESULTS_QUEUE_ARGS,
+            )
+        except pika.exceptions.ChannelClosedByBroker:
+            # الـ queue القديمة متعملة بـ properties مختلفة - نمسحها ونعيد الإعلان
+            self.rabbitmq_channel = self.rabbitmq_connection.channel()
+            self.rabbitmq_channel.queue_delete(queue="results_queue")
+            self.rabbitmq_channel.queue_declare(
+                queue="results_queue",
+                durable=False,
+                arguments=RESULTS_QUEUE_ARGS,
+            )
+
     def ensure_rabbitmq(self):
         """يتأكد إن الـ connection شغال، لو مش شغال يـ reconnect"""
         if self.rabbitmq_connection and self.rabbitmq_connection.is_open:
@@ -351,6 +565,11 @@ class ViolationDetector:
                     user=self.pg_user,
                     password=self.pg_pass,
                     database=self.pg_db,
+                    # TCP keepalives بدل ما نعمل SELECT 1 ping كل شوية
+                    keepalives=1,
+                    keepalives_idle=30,
+                    keepalives_interval=10,
+                    keepalives_count=3,
                 )
                 self.pg_connection.autocommit = False
                 self.create_tables()
@@ -366,19 +585,11 @@ class ViolationDetector:
         return False
 
     def ensure_postgres(self):
-        """يتأكد إن الـ DB connection شغال"""
-        try:
-            # بيـ ping الـ connection عشان يتأكد شغال
-            self.pg_connection.cursor().execute("SELECT 1")
+        """يتأكد إن الـ connection لسه مفتوح - الـ keepalives بتغني عن الـ SELECT 1 ping"""
+        if self.pg_connection is not None and not self.pg_connection.closed:
             return True
-        except Exception:
-            logger.warning("PostgreSQL connection lost, reconnecting...")
-            try:
-                if self.pg_connection:
-                    self.pg_connection.close()
-            except Exception:
-                pass
-            return self.connect_postgres()
+        logger.warning("PostgreSQL connection lost, reconnecting...")
+        return self.connect_postgres()
 
     def create_tables(self):
         with self.pg_connection.cursor() as cursor:
@@ -400,22 +611,71 @@ class ViolationDetector:
             self.pg_connection.commit()
 
     # ---------------- Model Loading ----------------
+    def export_engine(self):
+        """يـ export الـ checkpoint لـ TensorRT engine بـ FP16 - مرة واحدة بس"""
+        try:
+            logger.info("Exporting best.pt to TensorRT engine (FP16)...")
+            YOLO(self.model_path).export(
+                format="engine",
+                imgsz=IMG_SIZE,
+                half=True,
+                dynamic=True,
+                batch=ENGINE_BATCH,
+            )
+            return os.path.exists(self.engine_path)
+        except Exception as e:
+            # لو الـ export فشل (مثلاً TensorRT مش متسطب) نكمل بالـ .pt عادي
+            logger.warning(f"TensorRT export failed, falling back to .pt: {e}")
+            return False
+
     def load_model(self):
-        """يحمل الـ YOLO model - يستخدم GPU لو متاحة"""
+        """يحمل الـ YOLO model - يفضل الـ TensorRT engine ويستخدم GPU لو متاحة"""
         try:
-            if not os.path.exists(self.model_path):
+            if not os.path.exists(self.model_path) and not os.path.exists(
+                self.engine_path
+            ):
                 logger.error(f"Model not found: {self.model_path}")
                 return False
 
-            self.model = YOLO(self.model_path)
-
-            # استخدم GPU لو متاحة، وإلا CPU
-            if torch.cuda.is_available():
-                self.model.to("cuda")
-                logger.info(f"Model loaded on GPU: {torch.cuda.get_device_name(0)}")
+            # مش محتاجين autograd خالص في الـ service ده
+            torch.set_grad_enabled(False)
+
+            use_gpu = torch.cuda.is_available()
+            if use_gpu:
+                torch.cuda.set_device(0)
+                # الـ imgsz ثابت فـ cuDNN يختار أسرع conv algorithm مرة ويعيد استخدامه
+                torch.backends.cudnn.benchmark = True
+                # لو مفيش engine جاهز نحاول نعمله دلوقتي (أول run بس)
+                if not os.path.exists(self.engine_path):
+                    self.export_engine()
+
+            if use_gpu and os.path.exists(self.engine_path):
+                # الـ YOLO wrapper بيشتغل مع الـ .engine بنفس الـ API
+                self.model = YOLO(self.engine_path, task="detect")
+                logger.info(
+                    f"TensorRT engine loaded on GPU: {torch.cuda.get_device_name(0)}"
+                )
             else:
-                self.model.to("cpu")
-                logger.info("Model loaded on CPU")
+                self.model = YOLO(self.model_path)
+                if use_gpu:
+                    self.model.to("cuda")
+                    logger.info(f"Model loaded on GPU: {torch.cuda.get_device_name(0)}")
+                else:
+                    self.model.to("cpu")
+                    logger.info("Model loaded on CPU")
+
+            # Class name → id lookup مرة واحدة بدل self.model.names[cls] لكل box
+            self.name2id = {v.lower(): k for k, v in self.model.names.items()}
+
+            # Warmup - أول call بيعمل context/binding allocation فياخد وقت
+            dummy = np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8)
+            with torch.inference_mode():
+                self.model(dummy, conf=CONF_THRESHOLD, imgsz=IMG_SIZE, verbose=False)
+
+            # Numba warmup - الـ JIT compile يحصل هنا مش على أول frame
+            iou_matrix(np.zeros((1, 4), np.float32), np.zeros((1, 4), np.float32))
+
+            logger.info("Model warmup done")
 
             return True
         except Exception as e:
@@ -447,61 +707,29 @@ class ViolationDetector:
                 2,
             )
 
-        # Hands
-        for box in hand_boxes:
-            x1, y1, x2, y2 = map(int, box)
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cv2.putText(
-                frame,
-                "Hand",
-                (x1, y1 - 5),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                (0, 255, 0),
-                2,
-            )
-
-        # Scoopers
-        for box in scooper_boxes:
-            x1, y1, x2, y2 = map(int, box)
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 0, 255), 2)
-            cv2.putText(
-                frame,
-                "Scooper",
-                (x1, y1 - 5),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                (255, 0, 255),
-                2,
-            )
-
-        # Pizzas
-        for box in pizza_boxes:
-            x1, y1, x2, y2 = map(int, box)
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 165, 255), 2)
-            cv2.putText(
-                frame,
-                "Pizza",
-                (x1, y1 - 5),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                (0, 165, 255),
-                2,
-            )
-
-        # Persons
-        for box in person_boxes:
-            x1, y1, x2, y2 = map(int, box)
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 1)
-            cv2.putText(
-                frame,
-                "Person",
-                (x1, y1 - 5),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.4,
-                (0, 255, 0),
-                1,
-            )
+        # Detections - pass واحد على كل الـ classes بدل 4 loops
+        # الـ int32 conversion بيحصل مرة واحدة للـ array مش map(int) لكل box
+        groups = (
+            ("Hand", hand_boxes),
+            ("Scooper", scooper_boxes),
+            ("Pizza", pizza_boxes),
+            ("Person", person_boxes),
+        )
+        for label, boxes in groups:
+            if not len(boxes):
+                continue
+            color, thickness, font_scale = DRAW_STYLES[label]
+            for x1, y1, x2, y2 in np.asarray(boxes, dtype=np.int32).tolist():
+                cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
+                cv2.putText(
+                    frame,
+                    label,
+                    (x1, y1 - 5),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale,
+                    color,
+                    thickness,
+                )
 
         # Violation count overlay
         v_count = self.tracker.get_violation_count()
@@ -533,53 +761,124 @@ class ViolationDetector:
 
     # ---------------- Frame Processing ----------------
     def process_frame(self, ch, method, properties, body):
-        """يـ process كل frame قادم من RabbitMQ"""
-        frame = None
+        """يستقبل msgpack batch من الـ frame_reader ويضيف الـ frames للـ buffer"""
         try:
-            message = json.loads(body)
-            frame_number = message["frame_number"]
-            timestamp = message["timestamp"]
-            frame_base64 = message["frame_data"]
+            # الـ message فيها batch من الـ frames بصيغة msgpack
+            items = msgpack.unpackb(body, raw=False)
+
+            decoded = []
+            for item in items:
+                frame = decode_jpeg(item["jpeg"])
+                if frame is None:
+                    logger.error(f"Failed to decode frame {item['n']}")
+                    continue
+                decoded.append((frame, item["n"], item["ts"]))
+
+            if not decoded:
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
 
-            # Decode frame
-            frame_bytes = base64.b64decode(frame_base64)
-            frame_array = np.frombuffer(frame_bytes, dtype=np.uint8)
-            frame = cv2.imdecode(frame_array, cv2.IMREAD_COLOR)
+            # الـ delivery_tag بيتربط بآخر frame في الـ message -
+            # الـ ack يحصل لما الـ message كلها تخلص processing
+            last = len(decoded) - 1
+            for k, (frame, frame_number, timestamp) in enumerate(decoded):
+                tag = method.delivery_tag if k == last else None
+                self._pending.append((frame, frame_number, timestamp, tag))
 
-            # حذف الـ intermediate arrays فوراً عشان نوفر RAM
-            del frame_bytes, frame_array
+            if len(self._pending) >= BATCH_SIZE:
+                self.flush_batch()
 
-            if frame is None:
-                logger.error(f"Failed to decode frame {frame_number}")
+        except Exception as e:
+            logger.error(f"Error buffering frames: {e}")
+            # حتى لو في خطأ نـ ack الـ message عشان مش يـ loop forever
+            try:
                 ch.basic_ack(delivery_tag=method.delivery_tag)
-                return
+            except Exception:
+                pass
+
+    def flush_batch(self):
+        """يشغل YOLO على الـ batch كله في forward pass واحد"""
+        if not self._pending:
+            return
 
-            # Run YOLO
-            results = self.model(frame, conf=CONF_THRESHOLD, verbose=False)[0]
-
-            # Parse detections
-            hand_boxes = []
-            scooper_boxes = []
-            pizza_boxes = []
-            person_boxes = []
-
-            for box in results.boxes:
-                cls = int(box.cls[0])
-                label = self.model.names[cls].lower()
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                bbox = (x1, y1, x2, y2)
-
-                if label == "hand":
-                    hand_boxes.append(bbox)
-                elif label == "scooper":
-                    scooper_boxes.append(bbox)
-                elif label == "pizza":
-                    pizza_boxes.append(bbox)
-                elif label == "person":
-                    person_boxes.append(bbox)
-
-            # حذف نتائج YOLO الخام فوراً
-            del results
+        batch = self._pending
+        self._pending = []
+
+        try:
+            frames = [item[0] for item in batch]
+            # inference_mode يشيل أي autograd tracking، والـ imgsz الثابت
+            # يخلي الـ cuDNN algorithm cache سخن
+            with torch.inference_mode():
+                results_list = self.model(
+                    frames, conf=CONF_THRESHOLD, imgsz=IMG_SIZE, verbose=False
+                )
+
+            # الـ HandTracker state متسلسل فلازم نمشي frame-by-frame بالترتيب
+            for (frame, frame_number, timestamp, tag), results in zip(
+                batch, results_list
+            ):
+                self.process_result(frame, frame_number, timestamp, results)
+                if tag is not None:
+                    self.rabbitmq_channel.basic_ack(delivery_tag=tag)
+
+            # مخالفات الـ batch كلها بتتكتب في insert واحد
+            self.flush_violations()
+
+        except Exception as e:
+            logger.error(f"Error processing batch: {e}")
+            for item in batch:
+                if item[3] is None:
+                    continue
+                try:
+                    self.rabbitmq_channel.basic_ack(delivery_tag=item[3])
+                except Exception:
+                    pass
+        finally:
+            # مفيش gc.collect() كل frame - الـ refcounting بيحرر الـ arrays لوحده
+            # نعمل full sweep كل فترة بس كـ safety net للـ cycles
+            self._frames_since_gc += len(batch)
+            if self._frames_since_gc >= GC_EVERY_FRAMES:
+                gc.collect()
+                self._frames_since_gc = 0
+
+    def results_has_consumers(self):
+        """بيشيك لو في حد متصل فعلاً على results_queue - مرة كل ثانية بس"""
+        now = time.time()
+        if now - self._consumers_checked_at > 1.0:
+            self._consumers_checked_at = now
+            try:
+                res = self.rabbitmq_channel.queue_declare(
+                    queue="results_queue", passive=True
+                )
+                self._has_consumers = res.method.consumer_count > 0
+            except Exception:
+                # لو الـ check فشل نفضل نبعت عادي أحسن ما نقطع الـ stream
+                self._has_consumers = True
+        return self._has_consumers
+
+    def flush_timer(self):
+        """Flush دوري - عشان آخر frames في الفيديو مش تستنى batch كامل"""
+        self.flush_batch()
+        self.rabbitmq_connection.call_later(BATCH_FLUSH_SECS, self.flush_timer)
+
+    def process_result(self, frame, frame_number, timestamp, results):
+        """يـ process نتيجة YOLO لـ frame واحد: tracking + drawing + publishing"""
+        try:
+            # Parse detections - نقرا الـ tensors مرة واحدة بدل per-box indexing
+            # (كل box.cls[0] كان بيعمل GPU→CPU sync لوحده)
+            boxes = results.boxes
+            if boxes is not None and len(boxes):
+                cls = boxes.cls.to(torch.int32).cpu().numpy()
+                xyxy = boxes.xyxy.to(torch.int32).cpu().numpy()
+                hand_boxes = xyxy[cls == self.name2id.get("hand", -1)].tolist()
+                scooper_boxes = xyxy[cls == self.name2id.get("scooper", -1)].tolist()
+                pizza_boxes = xyxy[cls == self.name2id.get("pizza", -1)].tolist()
+                person_boxes = xyxy[cls == self.name2id.get("person", -1)].tolist()
+            else:
+                hand_boxes = []
+                scooper_boxes = []
+                pizza_boxes = []
+                person_boxes = []
 
             # Run HandTracker
             new_violations = self.tracker.update(
@@ -588,72 +887,69 @@ class ViolationDetector:
 
             has_violation = len(new_violations) > 0
 
-            # Draw على نفس الـ frame بدل ما نـ copy (توفير RAM)
-            self.draw_frame(
-                frame,
-                hand_boxes,
-                scooper_boxes,
-                pizza_boxes,
-                person_boxes,
-                has_violation,
-            )
+            # الرسم للـ visualization بس - نـ skip ه لو مفيش حد بيتفرج
+            # ولا في مخالفة محتاجة snapshot annotated
+            want_preview = self.results_has_consumers()
+            if want_preview or has_violation:
+                # Draw على نفس الـ frame بدل ما نـ copy (توفير RAM)
+                self.draw_frame(
+                    frame,
+                    hand_boxes,
+                    scooper_boxes,
+                    pizza_boxes,
+                    person_boxes,
+                    has_violation,
+                )
 
             # حفظ كل المخالفات الجديدة (مش بس الأخيرة)
+            # الـ imwrite بيحصل في الـ I/O pool - نعمل copy عشان الـ buffer reuse
             if has_violation:
-                self.ensure_postgres()
                 for violation in new_violations:
-                    self.save_violation(frame, frame_number, timestamp, violation)
-
-            # Encode الـ frame المـ annotated
-            _, buffer = cv2.imencode(
-                ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
-            )
-            annotated_base64 = base64.b64encode(buffer).decode("utf-8")
-            del buffer  # حذف فوراً
-
-            # Publish results
-            result_message = {
-                "frame_number": frame_number,
-                "timestamp": timestamp,
-                "frame_data": annotated_base64,
-                "violation_detected": has_violation,
-                "violation_count": self.tracker.get_violation_count(),
-            }
-            del annotated_base64  # حذف فوراً بعد ما دخل في الـ message
-
-            # تأكد إن RabbitMQ connection شغال قبل الـ publish
-            self.ensure_rabbitmq()
-            self.rabbitmq_channel.basic_publish(
-                exchange="",
-                routing_key="results_queue",
-                body=json.dumps(result_message),
-                properties=pika.BasicProperties(delivery_mode=2),
-            )
-            del result_message
-
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-
+                    self._io_pool.submit(
+                        self.save_violation,
+                        frame.copy(),
+                        frame_number,
+                        timestamp,
+                        violation,
+                    )
+
+            if want_preview:
+                # الـ preview بيتبعت بـ resolution أقل - الـ encode والـ bandwidth
+                # بيتناسبوا مع عدد البكسلات، والـ full res محفوظ في المخالفات
+                preview = cv2.resize(
+                    frame, (PREVIEW_W, PREVIEW_H), interpolation=cv2.INTER_AREA
+                )
+                jpeg_bytes = encode_jpeg(preview)
+
+                # تأكد إن RabbitMQ connection شغال قبل الـ publish
+                # الـ body هو الـ JPEG مباشرة والـ metadata في الـ headers
+                self.ensure_rabbitmq()
+                self.rabbitmq_channel.basic_publish(
+                    exchange="",
+                    routing_key="results_queue",
+                    body=jpeg_bytes,
+                    properties=pika.BasicProperties(
+                        delivery_mode=1,  # transient - مفيش fsync للـ preview
+                        content_type="image/jpeg",
+                        headers={
+                            "frame_number": frame_number,
+                            "timestamp": timestamp,
+                            "violation_detected": has_violation,
+                            "violation_count": self.tracker.get_violation_count(),
+                        },
+                    ),
+                )
             if frame_number % 30 == 0:
                 logger.info(
                     f"Frame {frame_number} | Violations: {self.tracker.get_violation_count()}"
                 )
 
         except Exception as e:
-            logger.error(f"Error processing frame: {e}")
-            # حتى لو في خطأ نـ ack الـ message عشان مش يـ loop forever
-            try:
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-            except Exception:
-                pass
-        finally:
-            # حذف الـ frame في كل الأحوال
-            del frame
-            # Garbage collect فوراً لو الـ memory تقيل
-            gc.collect()
+            logger.error(f"Error processing frame {frame_number}: {e}")
 
     # ---------------- Violation Saving ----------------
     def save_violation(self, frame, frame_number, timestamp, violation_data):
-        """يحفظ صورة المخالفة في الـ disk والـ record في الـ DB"""
+        """يحفظ صورة المخالفة في الـ disk ويضيف الـ row للـ batch بتاع الـ DB"""
         try:
             output_dir = "/app/violations"
             os.makedirs(output_dir, exist_ok=True)
@@ -663,24 +959,19 @@ class ViolationDetector:
             frame_path = os.path.join(output_dir, frame_filename)
             cv2.imwrite(frame_path, frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
 
-            # حفظ في DB
-            with self.pg_connection.cursor() as cursor:
-                cursor.execute(
-                    """
-                    INSERT INTO violations 
-                    (frame_number, timestamp, violation_type, frame_path, confidence, metadata)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    """,
+            # الـ insert نفسه بيتعمل batched في flush_violations
+            # الـ lock عشان الـ method دي بتتنده من الـ I/O pool threads
+            with self._pg_lock:
+                self._violation_batch.append(
                     (
                         frame_number,
                         timestamp,
                         "no_scooper",
                         frame_path,
                         1.0,
-                        json.dumps(violation_data),
-                    ),
+                        orjson.dumps(violation_data).decode(),
+                    )
                 )
-                self.pg_connection.commit()
 
             logger.info(
                 f"Violation saved: {frame_path} | ROI: {violation_data['roi_name']}"
@@ -688,12 +979,38 @@ class ViolationDetector:
 
         except Exception as e:
             logger.error(f"Save violation error: {e}")
-            # لو في خطأ في الـ DB حاول rollback
+
+    def flush_violations(self):
+        """يكتب كل الـ violation rows المتجمعة في round-trip واحد"""
+        with self._pg_lock:
+            if not self._violation_batch:
+                return
+
+            rows = self._violation_batch
+            self._violation_batch = []
+
             try:
-                if self.pg_connection:
-                    self.pg_connection.rollback()
-            except Exception:
-                pass
+                self.ensure_postgres()
+                with self.pg_connection.cursor() as cursor:
+                    execute_values(
+                        cursor,
+                        """
+                        INSERT INTO violations
+                        (frame_number, timestamp, violation_type, frame_path, confidence, metadata)
+                        VALUES %s
+                        """,
+                        rows,
+                    )
+                self.pg_connection.commit()
+
+            except Exception as e:
+                logger.error(f"Violation flush error: {e}")
+                # لو في خطأ في الـ DB حاول rollback
+                try:
+                    if self.pg_connection:
+                        self.pg_connection.rollback()
+                except Exception:
+                    pass
 
     # ---------------- Main Start ----------------
     def start_consuming(self):
@@ -718,13 +1035,21 @@ class ViolationDetector:
         logger.info("Waiting for frames...")
         logger.info("=" * 50)
 
-        # prefetch_count=1 عشان الـ detection ثقيل ومحتاج يـ finish قبل ما يـ start تاني
-        self.rabbitmq_channel.basic_qos(prefetch_count=1)
+        # prefetch_count=BATCH_SIZE عشان نقدر نجمع batch كامل قبل الـ inference
+        self.rabbitmq_channel.basic_qos(prefetch_count=BATCH_SIZE)
         self.rabbitmq_channel.basic_consume(
             queue="frame_queue", on_message_callback=self.process_frame
         )
 
-        self.rabbitmq_channel.start_consuming()
+        # Flush timer عشان الـ batches الناقصة (آخر الفيديو / stream بطيء)
+        self.rabbitmq_connection.call_later(BATCH_FLUSH_SECS, self.flush_timer)
+
+        try:
+            self.rabbitmq_channel.start_consuming()
+        finally:
+            # نستنى كتابة أي مخالفات معلقة قبل ما نقفل
+            self._io_pool.shutdown(wait=True)
+            self.flush_violations()
 
 
 # ---------------- Entry Point ----------------
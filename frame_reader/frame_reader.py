@@ -1,16 +1,210 @@
 import cv2
 import pika
-import json
+import msgpack
 import time
 import os
-import base64
 import logging
+import threading
+import queue
 from datetime import datetime
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# JPEG encode settings - explicit quality instead of OpenCV's expensive default 95
+JPEG_QUALITY = int(os.getenv('JPEG_Q', '80'))
+
+# Prefer TurboJPEG (SIMD DCT/Huffman + 4:2:0 subsampling) when libjpeg-turbo
+# is available; falls back to OpenCV's built-in encoder
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    _tj = TurboJPEG()
+except Exception:
+    _tj = None
+
+# Optional nvJPEG encode on GPU hosts (USE_NVJPEG=1): DCT+Huffman run on
+# fixed-function silicon and the CPU only pays the host->device upload.
+# torch/torchvision are deliberately not in this image's requirements -
+# install them only where a GPU actually exists.
+_torch = None
+_nvjpeg = None
+if os.getenv('USE_NVJPEG', '0') == '1':
+    try:
+        import torch as _torch
+        from torchvision.io import encode_jpeg as _nvjpeg
+        if not _torch.cuda.is_available():
+            _torch = _nvjpeg = None
+    except Exception:
+        _torch = _nvjpeg = None
+
+
+def encode_frame(frame):
+    """Encode a BGR frame to JPEG bytes with the fastest available encoder"""
+    if _nvjpeg is not None:
+        # nvJPEG wants RGB CHW uint8 on the device; the result comes back
+        # as a small CPU tensor of the compressed bytes
+        rgb = _torch.from_numpy(frame[:, :, ::-1].copy()).permute(2, 0, 1)
+        return bytes(_nvjpeg(rgb.cuda(), quality=JPEG_QUALITY).cpu().numpy())
+    if _tj is not None:
+        return _tj.encode(frame, quality=JPEG_QUALITY, jpeg_subsample=TJSAMP_420)
+    _, buffer = cv2.imencode(
+        '.jpg', frame,
+        [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY, cv2.IMWRITE_JPEG_PROGRESSIVE, 0]
+    )
+    return buffer.tobytes()
+
+
+# Frames per AMQP message - one basic_publish per batch amortizes the
+# BlockingConnection per-call overhead
+PUBLISH_BATCH = int(os.getenv('PUBLISH_BATCH', '8'))
+
+
+class PendingBuffer:
+    """Accumulates encoded frames so we publish one message per batch"""
+
+    def __init__(self, size):
+        self.size = size
+        self.buf = []
+
+    def add(self, frame_number, timestamp, shape, jpeg_bytes):
+        self.buf.append({
+            'n': frame_number,
+            'ts': timestamp,
+            'shape': shape,
+            'jpeg': jpeg_bytes,
+        })
+
+    def full(self):
+        return len(self.buf) >= self.size
+
+    def flush(self):
+        """Serialize and clear the buffer; returns (body, frame_count)"""
+        batch, self.buf = self.buf, []
+        return msgpack.packb(batch, use_bin_type=True), len(batch)
+
+
+# Bound frame_queue so stale frames get dropped if the detector falls behind -
+# a 2s old frame is useless for a real-time monitor
+FRAME_QUEUE_ARGS = {
+    'x-message-ttl': 2000,
+    'x-max-length': 60,
+    'x-overflow': 'drop-head',
+}
+
+# Max publishes queued to the ioloop thread before the read loop blocks -
+# bounds memory without waiting on the socket per message
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', '32'))
+
+
+class AsyncPublisher:
+    """Publishes frames through a SelectConnection running on its own thread
+
+    BlockingConnection waits on socket I/O inside every basic_publish, which
+    caps throughput at whatever one synchronous round trip allows. Driving
+    pika's SelectConnection ioloop from a background thread lets decode and
+    encode keep running while batches drain to the broker; a bounded in-flight
+    window provides backpressure instead of per-message waits.
+    """
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.connection = None
+        self.channel = None
+        self.ready = threading.Event()
+        self._in_flight = threading.Semaphore(MAX_IN_FLIGHT)
+        self._thread = None
+        self._redeclared = False
+
+    def start(self, timeout=15):
+        """Start the ioloop thread; returns True once the queue is declared"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self.ready.wait(timeout)
+
+    def _run(self):
+        self.connection = pika.SelectConnection(
+            self.parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_open_error,
+            on_close_callback=lambda conn, reason: conn.ioloop.stop()
+        )
+        self.connection.ioloop.start()
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_open_error(self, connection, error):
+        logger.error(f"❌ Async connection failed to open: {error}")
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.queue_declare(
+            queue='frame_queue', durable=False, arguments=FRAME_QUEUE_ARGS,
+            callback=self._on_queue_declared
+        )
+
+    def _on_channel_closed(self, channel, reason):
+        # Existing queue was declared with different properties - delete it
+        # and redeclare with the new arguments (once, to avoid a close loop)
+        if not self._redeclared and self.connection.is_open:
+            self._redeclared = True
+            self.connection.channel(on_open_callback=self._on_recovery_channel_open)
+
+    def _on_recovery_channel_open(self, channel):
+        self.channel = channel
+        channel.queue_delete(
+            queue='frame_queue',
+            callback=lambda _frame: channel.queue_declare(
+                queue='frame_queue', durable=False, arguments=FRAME_QUEUE_ARGS,
+                callback=self._on_queue_declared
+            )
+        )
+
+    def _on_queue_declared(self, _frame):
+        self.ready.set()
+
+    def publish(self, body, properties):
+        """Hand a publish to the ioloop thread; blocks only when the
+        in-flight window is full"""
+        if self.channel is None or not self.channel.is_open:
+            return False
+        self._in_flight.acquire()
+        self.connection.ioloop.add_callback_threadsafe(
+            lambda: self._do_publish(body, properties)
+        )
+        return True
+
+    def _do_publish(self, body, properties):
+        try:
+            self.channel.basic_publish(
+                exchange='', routing_key='frame_queue',
+                body=body, properties=properties
+            )
+        except Exception as e:
+            logger.error(f"❌ Error publishing batch: {e}")
+        finally:
+            self._in_flight.release()
+
+    def close(self, drain_timeout=10):
+        """Drain the in-flight window, then shut the connection down
+
+        If the connection dropped, callbacks already queued to the ioloop
+        never run and their permits are never released - acquire with a
+        deadline so a broker failure mid-video can't hang the process.
+        """
+        deadline = time.monotonic() + drain_timeout
+        for _ in range(MAX_IN_FLIGHT):
+            if not self._in_flight.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                logger.warning("⚠️ Timed out draining in-flight publishes")
+                break
+        if self.connection and self.connection.is_open:
+            self.connection.ioloop.add_callback_threadsafe(self.connection.close)
+        if self._thread:
+            self._thread.join(timeout=10)
+
 
 class FrameReader:
     def __init__(self):
@@ -20,15 +214,14 @@ class FrameReader:
         self.rabbitmq_pass = os.getenv('RABBITMQ_PASS', 'admin123')
         self.video_path = os.getenv('VIDEO_PATH', '/app/videos/test_video.mp4')
         
-        self.connection = None
-        self.channel = None
+        self.publisher = None
         self.frame_count = 0
-        
+
     def connect_rabbitmq(self):
         """Connect to RabbitMQ with retry logic"""
         max_retries = 10
         retry_delay = 5
-        
+
         for attempt in range(max_retries):
             try:
                 credentials = pika.PlainCredentials(self.rabbitmq_user, self.rabbitmq_pass)
@@ -39,57 +232,108 @@ class FrameReader:
                     heartbeat=600,
                     blocked_connection_timeout=300
                 )
-                
-                self.connection = pika.BlockingConnection(parameters)
-                self.channel = self.connection.channel()
-                
-                # Declare queue
-                self.channel.queue_declare(queue='frame_queue', durable=True)
-                
-                logger.info("✅ Connected to RabbitMQ successfully!")
-                return True
-                
+
+                self.publisher = AsyncPublisher(parameters)
+                if self.publisher.start():
+                    logger.info("✅ Connected to RabbitMQ successfully!")
+                    return True
+
+                self.publisher.close()
+                raise ConnectionError("async publisher did not become ready")
+
             except Exception as e:
                 logger.error(f"❌ Failed to connect to RabbitMQ (attempt {attempt + 1}/{max_retries}): {e}")
                 if attempt < max_retries - 1:
                     time.sleep(retry_delay)
-                    
+
         return False
     
-    def publish_frame(self, frame, frame_number, timestamp):
-        """Publish frame to RabbitMQ"""
+    def open_capture(self):
+        """Open the video capture, preferring hardware decode (NVDEC/VAAPI)
+
+        H.264/H.265 decode is the dominant producer cost; routing it through
+        FFmpeg's hardware decoder frees the CPU for JPEG encode + publish.
+        Falls back to the default CPU decoder if the hardware path fails.
+        """
+        if os.getenv('HW_DECODE', '1') == '1':
+            hw_codec = os.getenv('HW_DECODE_CODEC', 'h264_cuvid')
+            os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = f'video_codec;{hw_codec}'
+
+            cap = cv2.VideoCapture(self.video_path, cv2.CAP_FFMPEG)
+            if cap.isOpened():
+                logger.info(f"🎞️ Opened with hardware decoder: {hw_codec}")
+                return self._tune_capture(cap)
+
+            logger.warning("⚠️ Hardware decoder unavailable, using CPU decode")
+            cap.release()
+            os.environ.pop('OPENCV_FFMPEG_CAPTURE_OPTIONS', None)
+
+        return self._tune_capture(cv2.VideoCapture(self.video_path))
+
+    @staticmethod
+    def _tune_capture(cap):
+        """Keep the capture's internal buffer at one frame
+
+        VIDEO_PATH can point at an RTSP/USB source, where V4L2/FFmpeg buffer
+        up to 4 frames by default and every buffered frame is extra latency
+        between the real world and what we publish. Harmless for file input,
+        and not every backend supports the property, hence best-effort.
+        """
         try:
-            # Encode frame to base64
-            _, buffer = cv2.imencode('.jpg', frame)
-            frame_base64 = base64.b64encode(buffer).decode('utf-8')
-            
-            # Prepare message
-            message = {
-                'frame_number': frame_number,
-                'timestamp': timestamp,
-                'frame_data': frame_base64,
-                'shape': frame.shape
-            }
-            
-            # Publish to queue
-            self.channel.basic_publish(
-                exchange='',
-                routing_key='frame_queue',
-                body=json.dumps(message),
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Make message persistent
-                )
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        except Exception:
+            pass
+        return cap
+
+    def publish_batch(self, body, count):
+        """Publish one msgpack batch of JPEG frames as a single AMQP message"""
+        return self.publisher.publish(
+            body,
+            pika.BasicProperties(
+                delivery_mode=1,  # Transient - a dropped live frame is fine
+                content_type='application/x-msgpack',
+                headers={'count': count}
             )
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"❌ Error publishing frame: {e}")
-            return False
+        )
     
+    # Stage queues are small on purpose - they exist to overlap the stages,
+    # not to buffer the video; a full queue stalls the stage behind it
+    STAGE_DEPTH = 8
+
+    def _decode_loop(self, cap, sample_every, frames_q):
+        """Stage 1: demux + decode sampled frames into frames_q"""
+        frame_index = 0
+        try:
+            while cap.grab():
+                frame_index += 1
+
+                # Skip frames we don't need - no decode cost for these
+                if frame_index % sample_every:
+                    continue
+
+                ret, frame = cap.retrieve()
+                if not ret:
+                    continue
+
+                frames_q.put((frame_index, datetime.now().isoformat(), frame))
+        finally:
+            frames_q.put(None)  # end-of-stream sentinel
+
+    def _encode_loop(self, frames_q, jpeg_q):
+        """Stage 2: JPEG-encode decoded frames into jpeg_q"""
+        try:
+            while True:
+                item = frames_q.get()
+                if item is None:
+                    break
+                frame_index, timestamp, frame = item
+                jpeg_q.put((frame_index, timestamp, list(frame.shape), encode_frame(frame)))
+        finally:
+            jpeg_q.put(None)
+
     def read_and_stream(self):
         """Read video and stream frames"""
-        
+
         if not self.connect_rabbitmq():
             logger.error("❌ Could not connect to RabbitMQ. Exiting...")
             return
@@ -100,7 +344,7 @@ class FrameReader:
             return
         
         logger.info(f"📹 Opening video: {self.video_path}")
-        cap = cv2.VideoCapture(self.video_path)
+        cap = self.open_capture()
         
         if not cap.isOpened():
             logger.error("❌ Failed to open video file")
@@ -108,44 +352,67 @@ class FrameReader:
         
         fps = int(cap.get(cv2.CAP_PROP_FPS))
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        
+
+        # Only decode every Nth frame based on TARGET_FPS - grab() advances the
+        # demuxer without running the full YUV->BGR decode for skipped frames
+        target_fps = int(os.getenv('TARGET_FPS', fps if fps > 0 else 30))
+        sample_every = max(1, int(fps / target_fps)) if fps > 0 and target_fps > 0 else 1
+
         logger.info(f"📊 Video Info: {total_frames} frames @ {fps} FPS")
+        logger.info(f"🎯 Sampling 1 of every {sample_every} frames (target {target_fps} FPS)")
         logger.info(f"🚀 Starting to stream frames...")
-        
-        frame_number = 0
+
+        published = 0
         start_time = time.time()
-        
+        pending = PendingBuffer(PUBLISH_BATCH)
+
+        # Pipeline the stages: decode and encode run on their own threads
+        # (OpenCV releases the GIL in both), publish stays on the main thread.
+        # Throughput becomes max(decode, encode, publish) instead of the sum.
+        frames_q = queue.Queue(maxsize=self.STAGE_DEPTH)
+        jpeg_q = queue.Queue(maxsize=self.STAGE_DEPTH)
+        threading.Thread(
+            target=self._decode_loop, args=(cap, sample_every, frames_q), daemon=True
+        ).start()
+        threading.Thread(
+            target=self._encode_loop, args=(frames_q, jpeg_q), daemon=True
+        ).start()
+
         try:
             while True:
-                ret, frame = cap.read()
-                
-                if not ret:
-                    logger.info("✅ Finished reading video")
+                item = jpeg_q.get()
+                if item is None:
                     break
-                
-                # Create timestamp
-                timestamp = datetime.now().isoformat()
-                
-                # Publish frame
-                if self.publish_frame(frame, frame_number, timestamp):
-                    frame_number += 1
-                    
-                    if frame_number % 30 == 0:  # Log every 30 frames
-                        elapsed = time.time() - start_time
-                        fps_actual = frame_number / elapsed if elapsed > 0 else 0
-                        logger.info(f"📤 Published {frame_number}/{total_frames} frames (Speed: {fps_actual:.1f} FPS)")
-                
-                # Control frame rate (optional - remove to go full speed)
-                # time.sleep(1.0 / fps)
-                
+                frame_index, timestamp, shape, jpeg_bytes = item
+
+                # Buffer the frame (keep frame_number tied to the source index)
+                pending.add(frame_index, timestamp, shape, jpeg_bytes)
+
+                if pending.full():
+                    body, count = pending.flush()
+                    if self.publish_batch(body, count):
+                        published += count
+
+                        if published % 32 < count:  # Log roughly every 32 frames
+                            elapsed = time.time() - start_time
+                            fps_actual = published / elapsed if elapsed > 0 else 0
+                            logger.info(f"📤 Published {published} frames ({frame_index}/{total_frames} read, Speed: {fps_actual:.1f} FPS)")
+
+            # Flush whatever is left at the end of the video
+            body, count = pending.flush()
+            if count and self.publish_batch(body, count):
+                published += count
+
+            logger.info("✅ Finished reading video")
+
         except KeyboardInterrupt:
             logger.info("⚠️ Interrupted by user")
-            
+
         finally:
             cap.release()
-            if self.connection:
-                self.connection.close()
-            logger.info(f"✅ Total frames published: {frame_number}")
+            if self.publisher:
+                self.publisher.close()
+            logger.info(f"✅ Total frames published: {published}")
 
 
 if __name__ == "__main__":
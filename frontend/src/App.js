@@ -1,4 +1,5 @@
 import React, { useState, useEffect, useRef } from 'react';
+import { decode } from '@msgpack/msgpack';
 import './App.css';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
@@ -19,6 +20,7 @@ function App() {
     if (streamMode !== 'websocket') return;
 
     const ws = new WebSocket(`ws://localhost:8000/ws/stream`);
+    ws.binaryType = 'arraybuffer';
     wsRef.current = ws;
 
     ws.onopen = () => {
@@ -27,33 +29,41 @@ function App() {
     };
 
     ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
-      
-      if (data.type === 'frame') {
-        // Update violation count
-        setViolationCount(data.violation_count);
-        
-        // Draw frame on canvas
-        const canvas = canvasRef.current;
-        if (canvas) {
-          const ctx = canvas.getContext('2d');
-          const img = new Image();
-          img.onload = () => {
-            canvas.width = img.width;
-            canvas.height = img.height;
-            ctx.drawImage(img, 0, 0);
-            
-            // Add violation indicator
-            if (data.violation_detected) {
-              ctx.fillStyle = 'rgba(255, 0, 0, 0.3)';
-              ctx.fillRect(0, 0, canvas.width, canvas.height);
-              ctx.font = '48px Arial';
-              ctx.fillStyle = 'red';
-              ctx.fillText('VIOLATION!', 50, 100);
-            }
-          };
-          img.src = `data:image/jpeg;base64,${data.frame_data}`;
-        }
+      // Text frames are keep-alive pings; frames arrive as binary:
+      // uint32-LE header length, msgpack header, raw JPEG bytes
+      if (typeof event.data === 'string') return;
+
+      const buf = event.data;
+      const headerLen = new DataView(buf).getUint32(0, true);
+      const meta = decode(new Uint8Array(buf, 4, headerLen));
+      const jpeg = new Blob([new Uint8Array(buf, 4 + headerLen)], { type: 'image/jpeg' });
+
+      // Update violation count
+      setViolationCount(meta.vc);
+
+      // Draw frame on canvas
+      const canvas = canvasRef.current;
+      if (canvas) {
+        const ctx = canvas.getContext('2d');
+        const img = new Image();
+        const url = URL.createObjectURL(jpeg);
+        img.onload = () => {
+          canvas.width = img.width;
+          canvas.height = img.height;
+          ctx.drawImage(img, 0, 0);
+          URL.revokeObjectURL(url);
+
+          // Add violation indicator
+          if (meta.vd) {
+            ctx.fillStyle = 'rgba(255, 0, 0, 0.3)';
+            ctx.fillRect(0, 0, canvas.width, canvas.height);
+            ctx.font = '48px Arial';
+            ctx.fillStyle = 'red';
+            ctx.fillText('VIOLATION!', 50, 100);
+          }
+        };
+        img.onerror = () => URL.revokeObjectURL(url);
+        img.src = url;
       }
     };
 
@@ -17,6 +17,12 @@ CREATE INDEX IF NOT EXISTS idx_violations_type ON violations(violation_type);
 CREATE INDEX IF NOT EXISTS idx_violations_created ON violations(created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_violations_frame ON violations(frame_number);
 
+-- Covering index for the paginated /api/violations listing: an index-only
+-- scan serves ORDER BY created_at DESC + LIMIT without touching the heap
+CREATE INDEX IF NOT EXISTS idx_violations_created_covering
+    ON violations (created_at DESC)
+    INCLUDE (id, frame_number, timestamp, violation_type, frame_path, confidence);
+
 -- Grant permissions
 GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA public TO pizza_user;
 GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA public TO pizza_user;
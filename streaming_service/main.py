@@ -1,13 +1,15 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse
+import asyncpg
 import os
-import json
 import asyncio
 import pika
-import base64
+import msgpack
+import orjson
+import struct
+import threading
+import time
 from datetime import datetime
 import logging
 
@@ -15,7 +17,12 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Pizza Violation Streaming Service")
+# orjson serializes datetimes natively and writes bytes directly - several
+# times faster than stdlib json on the large /api/violations payloads
+app = FastAPI(
+    title="Pizza Violation Streaming Service",
+    default_response_class=ORJSONResponse,
+)
 
 # CORS middleware
 app.add_middleware(
@@ -39,18 +46,100 @@ RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', 5672))
 RABBITMQ_USER = os.getenv('RABBITMQ_USER', 'admin')
 RABBITMQ_PASS = os.getenv('RABBITMQ_PASS', 'admin123')
 
+# results_queue is transient with drop-head - must match the detector's declaration
+RESULTS_QUEUE_ARGS = {'x-max-length': 100, 'x-overflow': 'drop-head'}
+
+# Prefetch a window of frames so each delivery doesn't wait a broker round trip
+PREFETCH = int(os.getenv('PREFETCH', '64'))
+
+
+# Hot queries as module constants. asyncpg keeps a per-connection LRU cache
+# of server-side prepared statements keyed on the exact query string, so
+# executing these shared strings means parse+plan happens once per pooled
+# connection and every later call is just bind+execute.
+SQL_ALL_VIOLATIONS = """
+    SELECT id, frame_number, timestamp, violation_type,
+           frame_path, confidence, created_at
+    FROM violations
+    ORDER BY created_at DESC
+    LIMIT $1 OFFSET $2
+"""
+SQL_VIOLATION_COUNT = "SELECT COUNT(*) FROM violations"
+SQL_VIOLATION_BY_ID = "SELECT * FROM violations WHERE id = $1"
+SQL_EXPORT_VIOLATIONS = """
+    SELECT id, frame_number, timestamp, violation_type,
+           frame_path, confidence, created_at
+    FROM violations
+    ORDER BY created_at DESC
+"""
+# All three stats in one round trip; Postgres shares the scan and we pay
+# one parse+plan+RTT instead of three
+SQL_STATS = """
+    WITH by_type AS (
+        SELECT violation_type, COUNT(*) AS count
+        FROM violations
+        GROUP BY violation_type
+    )
+    SELECT
+        (SELECT COUNT(*) FROM violations) AS total,
+        (SELECT COUNT(*) FROM violations
+          WHERE created_at >= NOW() - INTERVAL '1 hour') AS recent,
+        (SELECT COALESCE(jsonb_agg(by_type), '[]'::jsonb) FROM by_type) AS by_type
+"""
+
+
+# Shared asyncpg pool - the handlers are async def, so a blocking driver
+# would stall the whole event loop (including the WebSocket stream) for the
+# duration of every query; asyncpg yields to the loop during network I/O
+# Dashboards poll count/stats several times a second; caching the response
+# for a couple of seconds collapses that to one query per TTL window per
+# worker, at the cost of at most STATS_TTL seconds of staleness
+STATS_TTL = float(os.getenv('STATS_TTL', '2'))
+_stats_cache = {}
+
+
+def _cache_get(key):
+    hit = _stats_cache.get(key)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+def _cache_set(key, value):
+    _stats_cache[key] = (time.monotonic() + STATS_TTL, value)
+    return value
+
+
+async def _init_connection(conn):
+    # asyncpg hands jsonb back as text by default; decode it so nested
+    # aggregates (e.g. the stats by_type array) serialize as real objects
+    await conn.set_type_codec(
+        'jsonb',
+        encoder=lambda v: orjson.dumps(v).decode(),
+        decoder=orjson.loads,
+        schema='pg_catalog',
+    )
 
-def get_db_connection():
-    """Get PostgreSQL connection"""
-    return psycopg2.connect(
+
+@app.on_event("startup")
+async def open_db_pool():
+    app.state.pool = await asyncpg.create_pool(
         host=PG_HOST,
         port=PG_PORT,
         user=PG_USER,
         password=PG_PASS,
-        database=PG_DB
+        database=PG_DB,
+        min_size=4,
+        max_size=16,
+        init=_init_connection,
     )
 
 
+@app.on_event("shutdown")
+async def close_db_pool():
+    await app.state.pool.close()
+
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -62,33 +151,20 @@ async def root():
 
 
 @app.get("/api/violations")
-async def get_violations():
-    """Get all violations"""
+async def get_violations(limit: int = 100, offset: int = 0):
+    """Get violations, newest first (paginated)"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute("""
-            SELECT id, frame_number, timestamp, violation_type, 
-                   frame_path, confidence, created_at
-            FROM violations
-            ORDER BY created_at DESC
-        """)
-        
-        violations = cursor.fetchall()
-        
-        # Convert datetime objects to strings
-        for v in violations:
-            if v['timestamp']:
-                v['timestamp'] = v['timestamp'].isoformat()
-            if v['created_at']:
-                v['created_at'] = v['created_at'].isoformat()
-        
-        cursor.close()
-        conn.close()
-        
+        # Clamp so a bad client can't request the whole table in one page
+        limit = max(1, min(limit, 1000))
+        offset = max(0, offset)
+
+        rows = await app.state.pool.fetch(SQL_ALL_VIOLATIONS, limit, offset)
+        violations = [dict(r) for r in rows]
+
         return {
             "total": len(violations),
+            "limit": limit,
+            "offset": offset,
             "violations": violations
         }
         
@@ -104,19 +180,16 @@ async def get_violations():
 async def get_violation_count():
     """Get total violation count"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM violations")
-        count = cursor.fetchone()[0]
-        
-        cursor.close()
-        conn.close()
-        
-        return {
+        cached = _cache_get('count')
+        if cached is not None:
+            return cached
+
+        count = await app.state.pool.fetchval(SQL_VIOLATION_COUNT)
+
+        return _cache_set('count', {
             "count": count,
             "timestamp": datetime.now().isoformat()
-        }
+        })
         
     except Exception as e:
         logger.error(f"❌ Error fetching count: {e}")
@@ -126,28 +199,39 @@ async def get_violation_count():
         )
 
 
+@app.get("/api/violations/export")
+async def export_violations():
+    """Stream every violation as one JSON array with bounded memory
+
+    fetchall() would materialize the whole table in Python and then a
+    second time as JSON. A server-side cursor pulls 1000 rows per batch
+    and each row is serialized and written out immediately, so memory
+    stays flat no matter how large the table grows and the first byte
+    goes out at first-row latency.
+    """
+    async def stream():
+        async with app.state.pool.acquire() as conn:
+            # asyncpg cursors only exist inside a transaction
+            async with conn.transaction():
+                first = True
+                async for record in conn.cursor(SQL_EXPORT_VIOLATIONS, prefetch=1000):
+                    yield b'[' if first else b','
+                    yield orjson.dumps(dict(record))
+                    first = False
+                if first:
+                    yield b'['
+                yield b']'
+
+    return StreamingResponse(stream(), media_type='application/json')
+
+
 @app.get("/api/violations/{violation_id}")
 async def get_violation(violation_id: int):
     """Get specific violation details"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute("""
-            SELECT * FROM violations WHERE id = %s
-        """, (violation_id,))
-        
-        violation = cursor.fetchone()
-        
-        if violation:
-            if violation['timestamp']:
-                violation['timestamp'] = violation['timestamp'].isoformat()
-            if violation['created_at']:
-                violation['created_at'] = violation['created_at'].isoformat()
-        
-        cursor.close()
-        conn.close()
-        
+        row = await app.state.pool.fetchrow(SQL_VIOLATION_BY_ID, violation_id)
+        violation = dict(row) if row else None
+
         if not violation:
             return JSONResponse(
                 status_code=404,
@@ -164,110 +248,197 @@ async def get_violation(violation_id: int):
         )
 
 
+def _frame_payload(properties, body):
+    """Build the binary WS frame: uint32-LE header length, msgpack header, JPEG
+
+    Body is raw JPEG bytes, metadata lives in AMQP headers. No base64 and
+    no json.dumps of a megabyte string per frame.
+    """
+    headers = properties.headers or {}
+    meta = msgpack.packb({
+        'n': headers.get('frame_number'),
+        'ts': headers.get('timestamp'),
+        'vd': bool(headers.get('violation_detected', False)),
+        'vc': headers.get('violation_count', 0),
+    }, use_bin_type=True)
+    return struct.pack('<I', len(meta)) + meta + body
+
+
+def _enqueue_frame(frames, item):
+    """Runs on the event loop; drops the oldest frame when the queue is full"""
+    if frames.full():
+        try:
+            frames.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    frames.put_nowait(item)
+
+
+class Broadcaster:
+    """Fans one results_queue consumer out to every connected viewer
+
+    Each viewer used to open its own AMQP connection and consumer, so the
+    broker round-robined deliveries and every client saw only 1/N of the
+    frames. One consumer thread decodes each message once and publishes
+    (ws_payload, jpeg) to a per-subscriber asyncio.Queue; a slow viewer
+    drops its own oldest frames without affecting the others.
+
+    The consumer only runs while subscribers exist: the detector checks
+    results_queue's consumer count to skip drawing/encoding previews when
+    nobody is watching, and a consumer parked here with zero viewers would
+    defeat that guard. The thread starts on first subscribe and is told to
+    stop on last unsubscribe.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.loop = None
+        self._stop = None
+        self._thread = None
+
+    def start(self, loop):
+        self.loop = loop
+
+    def shutdown(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    def subscribe(self):
+        q = asyncio.Queue(maxsize=PREFETCH)
+        self.subscribers.add(q)
+        # A stopping thread keeps its own (set) event and exits on its own,
+        # so a fresh event always means a fresh consumer
+        if self._stop is None or self._stop.is_set():
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._consume_loop, args=(self._stop,), daemon=True
+            )
+            self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        self.subscribers.discard(q)
+        if not self.subscribers:
+            self._stop.set()
+
+    def _publish(self, item):
+        # Runs on the event loop, like subscribe/unsubscribe - no locking needed
+        for q in list(self.subscribers):
+            _enqueue_frame(q, item)
+
+    def _consume_loop(self, stop):
+        """Blocking AMQP consume loop - runs on its own thread
+
+        channel.consume is a blocking iterator; running it inside an async
+        handler froze the event loop for up to inactivity_timeout per poll.
+        The thread packs each message off-loop and hands the finished
+        payload to the event loop with call_soon_threadsafe. Reconnects on
+        broker errors until told to stop.
+        """
+        while not stop.is_set():
+            try:
+                credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+                parameters = pika.ConnectionParameters(
+                    host=RABBITMQ_HOST,
+                    port=RABBITMQ_PORT,
+                    credentials=credentials
+                )
+
+                connection = pika.BlockingConnection(parameters)
+                channel = connection.channel()
+                channel.queue_declare(queue='results_queue', durable=False, arguments=RESULTS_QUEUE_ARGS)
+                channel.basic_qos(prefetch_count=PREFETCH)
+
+                for method, properties, body in channel.consume('results_queue', inactivity_timeout=1):
+                    if stop.is_set():
+                        break
+                    if method is None:
+                        continue
+
+                    try:
+                        self.loop.call_soon_threadsafe(
+                            self._publish, (_frame_payload(properties, body), body)
+                        )
+                    except Exception as e:
+                        logger.error(f"❌ Error processing message: {e}")
+                    channel.basic_ack(delivery_tag=method.delivery_tag)
+
+                connection.close()
+
+            except Exception as e:
+                logger.error(f"❌ Results consumer error: {e}")
+                stop.wait(5)
+
+
+broadcaster = Broadcaster()
+
+
+@app.on_event("startup")
+async def start_broadcaster():
+    broadcaster.start(asyncio.get_running_loop())
+
+
+@app.on_event("shutdown")
+def stop_broadcaster():
+    broadcaster.shutdown()
+
+
 @app.websocket("/ws/stream")
 async def websocket_stream(websocket: WebSocket):
     """WebSocket endpoint for real-time video streaming"""
     await websocket.accept()
     logger.info("🔌 WebSocket client connected")
-    
+
+    frames = broadcaster.subscribe()
+
     try:
-        # Connect to RabbitMQ
-        credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-        parameters = pika.ConnectionParameters(
-            host=RABBITMQ_HOST,
-            port=RABBITMQ_PORT,
-            credentials=credentials
-        )
-        
-        connection = pika.BlockingConnection(parameters)
-        channel = connection.channel()
-        channel.queue_declare(queue='results_queue', durable=True)
-        
-        # Consume messages
-        for method, properties, body in channel.consume('results_queue', inactivity_timeout=1):
-            if method is None:
+        while True:
+            try:
+                payload, _ = await asyncio.wait_for(frames.get(), timeout=1)
+            except asyncio.TimeoutError:
                 # Check if websocket is still connected
-                try:
-                    await websocket.send_json({"type": "ping"})
-                except:
-                    break
+                await websocket.send_json({"type": "ping"})
                 continue
-            
-            try:
-                message = json.loads(body)
-                
-                # Send frame to client
-                await websocket.send_json({
-                    "type": "frame",
-                    "frame_number": message['frame_number'],
-                    "timestamp": message['timestamp'],
-                    "frame_data": message['frame_data'],
-                    "violation_detected": message.get('violation_detected', False),
-                    "violation_count": message.get('violation_count', 0)
-                })
-                
-                # Acknowledge message
-                channel.basic_ack(delivery_tag=method.delivery_tag)
-                
-            except Exception as e:
-                logger.error(f"❌ Error processing message: {e}")
-                channel.basic_ack(delivery_tag=method.delivery_tag)
-        
-        connection.close()
-        
+
+            await websocket.send_bytes(payload)
+
     except WebSocketDisconnect:
         logger.info("🔌 WebSocket client disconnected")
     except Exception as e:
         logger.error(f"❌ WebSocket error: {e}")
     finally:
+        broadcaster.unsubscribe(frames)
         try:
             await websocket.close()
         except:
             pass
 
 
+# Preassembled once - the per-frame cost is then just yielding references,
+# not reallocating boundary + payload into a fresh bytes object per frame
+MJPEG_BOUNDARY = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MJPEG_TRAILER = b'\r\n'
+
+
 @app.get("/api/stream/mjpeg")
 async def mjpeg_stream():
     """MJPEG stream endpoint (alternative to WebSocket)"""
-    
-    def generate_frames():
+
+    async def generate_frames():
+        frames = broadcaster.subscribe()
         try:
-            # Connect to RabbitMQ
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-            parameters = pika.ConnectionParameters(
-                host=RABBITMQ_HOST,
-                port=RABBITMQ_PORT,
-                credentials=credentials
-            )
-            
-            connection = pika.BlockingConnection(parameters)
-            channel = connection.channel()
-            channel.queue_declare(queue='results_queue', durable=True)
-            
-            # Consume messages
-            for method, properties, body in channel.consume('results_queue'):
-                if method is None:
-                    continue
-                
-                try:
-                    message = json.loads(body)
-                    frame_base64 = message['frame_data']
-                    frame_bytes = base64.b64decode(frame_base64)
-                    
-                    # Yield frame in MJPEG format
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                    
-                    channel.basic_ack(delivery_tag=method.delivery_tag)
-                    
-                except Exception as e:
-                    logger.error(f"❌ Error in MJPEG stream: {e}")
-                    channel.basic_ack(delivery_tag=method.delivery_tag)
-            
-            connection.close()
-            
+            while True:
+                # Body is already raw JPEG bytes - yield the parts separately
+                # so the JPEG payload is never copied into a combined buffer
+                _, body = await frames.get()
+                yield MJPEG_BOUNDARY
+                yield body
+                yield MJPEG_TRAILER
+
         except Exception as e:
             logger.error(f"❌ MJPEG stream error: {e}")
+        finally:
+            broadcaster.unsubscribe(frames)
     
     return StreamingResponse(
         generate_frames(),
@@ -279,38 +450,18 @@ async def mjpeg_stream():
 async def get_stats():
     """Get system statistics"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Total violations
-        cursor.execute("SELECT COUNT(*) as total FROM violations")
-        total = cursor.fetchone()['total']
-        
-        # Violations by type
-        cursor.execute("""
-            SELECT violation_type, COUNT(*) as count
-            FROM violations
-            GROUP BY violation_type
-        """)
-        by_type = cursor.fetchall()
-        
-        # Recent violations (last hour)
-        cursor.execute("""
-            SELECT COUNT(*) as recent
-            FROM violations
-            WHERE created_at >= NOW() - INTERVAL '1 hour'
-        """)
-        recent = cursor.fetchone()['recent']
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            "total_violations": total,
-            "violations_by_type": by_type,
-            "recent_violations": recent,
+        cached = _cache_get('stats')
+        if cached is not None:
+            return cached
+
+        row = await app.state.pool.fetchrow(SQL_STATS)
+
+        return _cache_set('stats', {
+            "total_violations": row['total'],
+            "violations_by_type": row['by_type'],
+            "recent_violations": row['recent'],
             "timestamp": datetime.now().isoformat()
-        }
+        })
         
     except Exception as e:
         logger.error(f"❌ Error fetching stats: {e}")